@@ -1,15 +1,23 @@
 import azure.functions as func
+import functools
 import logging
 import os
 import json
-from datetime import datetime, date
-from typing import List, Dict, Any
-import pandas as pd
+import orjson
+from datetime import datetime, date, timedelta, timezone
+from typing import List, Dict, Any, Iterable, Tuple, BinaryIO, Union
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import psycopg2
-from psycopg2.extras import RealDictCursor
-import requests
+import psycopg2.pool
 import base64
+import csv
+import gzip
 import io
+import itertools
+import operator
+import shutil
+import threading
+import zipfile
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -17,102 +25,400 @@ load_dotenv()
 
 app = func.FunctionApp()
 
+# Shared clients, created on first use and reused across invocations on a warm worker
+_PG_POOL = None
+_HTTP_SESSION = None
+_BLOB_SERVICE = None
+_SETTINGS = None
+# Guards creation of the shared clients so concurrent first uses on a cold worker build one each
+_CLIENTS_LOCK = threading.Lock()
+# Names of the report queries whose plans this worker has already checked
+_QUERY_PLANS_CHECKED = set()
+
+# The report export runs up to three queries at once, each on its own connection. Keep that
+# many connections open between runs, and cap the pool so overlapping invocations on one
+# worker (timer and HTTP, or several HTTP calls) wait for a free connection instead of
+# failing with PoolError; three runs fit in the pool at once
+_DB_POOL_MIN_CONNECTIONS = 3
+_DB_POOL_MAX_CONNECTIONS = 9
+_DB_CONNECTION_WAIT_SECONDS = 120
+_DB_POOL_SLOTS = threading.BoundedSemaphore(_DB_POOL_MAX_CONNECTIONS)
+
+# Settings each part of the app needs, checked only by the callers that use them
+_REQUIRED_SETTINGS = {
+    'database': ('DB_CONNECTION_STRING',),
+    'email': ('SENDGRID_BEARER_TOKEN', 'SENDGRID_ENDPOINT', 'SENDER_EMAIL'),
+    'recipients': ('RECIPIENT_EMAILS',),
+    'reports': ('CUMULATIVE_START_DATE',)
+}
+
+def get_settings(*required: str) -> Dict[str, Any]:
+    """
+    Read the app settings once, caching them for later invocations, and check that the
+    settings of each named group in _REQUIRED_SETTINGS are set.
+    """
+    global _SETTINGS
+    if _SETTINGS is None:
+        recipient_emails = os.getenv('RECIPIENT_EMAILS')
+        cumulative_start_date = os.getenv('CUMULATIVE_START_DATE')
+        _SETTINGS = {
+            'db_connection_string': os.getenv('DB_CONNECTION_STRING'),
+            'sendgrid_bearer_token': os.getenv('SENDGRID_BEARER_TOKEN'),
+            'sendgrid_endpoint': os.getenv('SENDGRID_ENDPOINT'),
+            'sender_email': os.getenv('SENDER_EMAIL'),
+            'recipient_emails': tuple(email.strip() for email in recipient_emails.split(',')) if recipient_emails else (),
+            'cumulative_start_date': datetime.strptime(cumulative_start_date, '%Y-%m-%d').date() if cumulative_start_date else None,
+            # Optional: when set, large reports are uploaded to Blob Storage and linked
+            'reports_storage_connection_string': os.getenv('REPORTS_STORAGE_CONNECTION_STRING'),
+            'reports_container': os.getenv('REPORTS_CONTAINER', 'reports')
+        }
+    
+    missing_settings = [
+        name for group in required for name in _REQUIRED_SETTINGS[group]
+        if not _SETTINGS[name.lower()]
+    ]
+    if missing_settings:
+        raise ValueError(f"Missing configuration: {', '.join(missing_settings)}")
+    return _SETTINGS
+
+def _is_connection_alive(conn) -> bool:
+    """Check that a pooled connection still reaches the server, using a trivial query."""
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+
 def get_db_connection():
-    """Create and return a database connection."""
+    """
+    Get a database connection from the shared connection pool, waiting for one to be
+    released when the pool is fully in use.
+    """
+    global _PG_POOL
     try:
-        conn = psycopg2.connect(os.getenv('DB_CONNECTION_STRING'))
-        return conn
+        if not _DB_POOL_SLOTS.acquire(timeout=_DB_CONNECTION_WAIT_SECONDS):
+            raise psycopg2.pool.PoolError("Timed out waiting for a free database connection")
+        try:
+            if _PG_POOL is None:
+                with _CLIENTS_LOCK:
+                    if _PG_POOL is None:
+                        _PG_POOL = psycopg2.pool.ThreadedConnectionPool(
+                            _DB_POOL_MIN_CONNECTIONS,
+                            _DB_POOL_MAX_CONNECTIONS,
+                            get_settings('database')['db_connection_string']
+                        )
+            
+            conn = _PG_POOL.getconn()
+            # Replace connections the server dropped while they sat idle in the pool (idle
+            # timeout, failover); at most every pooled connection can be stale
+            for _ in range(_DB_POOL_MAX_CONNECTIONS):
+                if _is_connection_alive(conn):
+                    break
+                _PG_POOL.putconn(conn, close=True)
+                conn = _PG_POOL.getconn()
+            return conn
+        except Exception:
+            _DB_POOL_SLOTS.release()
+            raise
     except Exception as e:
         logging.error(f"Database connection failed: {str(e)}")
         raise
 
+def release_db_connection(conn) -> None:
+    """Return a database connection to the shared connection pool."""
+    if _PG_POOL is not None:
+        _PG_POOL.putconn(conn)
+        _DB_POOL_SLOTS.release()
+    else:
+        conn.close()
+
+def get_http_session():
+    """Get the shared HTTP session used for SendGrid requests."""
+    global _HTTP_SESSION
+    if _HTTP_SESSION is None:
+        with _CLIENTS_LOCK:
+            if _HTTP_SESSION is None:
+                # Imported on first send to keep requests off the cold-start path
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util import Retry
+                
+                # Retry transient SendGrid failures with backoff rather than losing the run's reports;
+                # the last response is still returned so its status is logged by the caller. Read
+                # errors are never retried: SendGrid may already have accepted a request whose
+                # response timed out, and retrying it would send the email twice
+                retry = Retry(
+                    total=4,
+                    connect=4,
+                    read=0,
+                    status=4,
+                    other=0,
+                    backoff_factor=0.5,
+                    status_forcelist=(500, 502, 503, 504, 429),
+                    allowed_methods=('POST',),
+                    raise_on_status=False
+                )
+                session = requests.Session()
+                session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry))
+                _HTTP_SESSION = session
+    return _HTTP_SESSION
+
+def get_blob_service_client():
+    """Get the shared Blob Storage client for report uploads, creating the container on first use."""
+    global _BLOB_SERVICE
+    if _BLOB_SERVICE is None:
+        with _CLIENTS_LOCK:
+            if _BLOB_SERVICE is None:
+                # Imported on first upload so deployments without Blob Storage never load it
+                from azure.core.exceptions import ResourceExistsError
+                from azure.storage.blob import BlobServiceClient
+                
+                settings = get_settings()
+                blob_service = BlobServiceClient.from_connection_string(settings['reports_storage_connection_string'])
+                # Download links are signed with the account key, so SAS connection strings cannot be used
+                if not getattr(blob_service.credential, 'account_key', None):
+                    raise ValueError("REPORTS_STORAGE_CONNECTION_STRING must be an account key connection string (AccountKey=...)")
+                try:
+                    blob_service.create_container(settings['reports_container'])
+                except ResourceExistsError:
+                    pass
+                _BLOB_SERVICE = blob_service
+    return _BLOB_SERVICE
+
+# Last day of each quarter's end month (March, June, September, December)
+_QUARTER_END_DAY = (31, 30, 30, 31)
+
+@functools.lru_cache(maxsize=256)
 def get_quarter_dates(current_date: date) -> tuple:
     """Calculate quarter start and end dates for the given date."""
     year = current_date.year
-    month = current_date.month
-    
-    if month in [1, 2, 3]:
-        quarter_start = date(year, 1, 1)
-        quarter_end = date(year, 3, 31)
-        quarter_num = 1
-    elif month in [4, 5, 6]:
-        quarter_start = date(year, 4, 1)
-        quarter_end = date(year, 6, 30)
-        quarter_num = 2
-    elif month in [7, 8, 9]:
-        quarter_start = date(year, 7, 1)
-        quarter_end = date(year, 9, 30)
-        quarter_num = 3
-    else:
-        quarter_start = date(year, 10, 1)
-        quarter_end = date(year, 12, 31)
-        quarter_num = 4
+    quarter_num = (current_date.month - 1) // 3 + 1
+    start_month = 3 * quarter_num - 2
     
-    return quarter_start, quarter_end, quarter_num
+    return date(year, start_month, 1), date(year, start_month + 2, _QUARTER_END_DAY[quarter_num - 1]), quarter_num
 
+@functools.lru_cache(maxsize=256)
 def is_quarter_end(current_date: date) -> bool:
     """Check if the current date is the end of a quarter."""
-    quarter_start, quarter_end, _ = get_quarter_dates(current_date)
-    return current_date == quarter_end
+    month = current_date.month
+    return month % 3 == 0 and current_date.day == _QUARTER_END_DAY[month // 3 - 1]
 
+@functools.lru_cache(maxsize=256)
 def get_previous_month_date(current_date: date) -> date:
     """Get the first day of the previous month."""
-    if current_date.month == 1:
-        return date(current_date.year - 1, 12, 1)
-    else:
-        return date(current_date.year, current_date.month - 1, 1)
+    month = current_date.month
+    return date(current_date.year - (month == 1), (month - 2) % 12 + 1, 1)
 
+@functools.lru_cache(maxsize=256)
 def get_previous_quarter_dates(current_date: date) -> tuple:
     """Get the start and end dates of the previous quarter."""
-    quarter_start, quarter_end, quarter_num = get_quarter_dates(current_date)
-    
-    if quarter_num == 1:
-        prev_quarter_start = date(current_date.year - 1, 10, 1)
-        prev_quarter_end = date(current_date.year - 1, 12, 31)
-    else:
-        if quarter_num == 2:
-            prev_quarter_start = date(current_date.year, 1, 1)
-            prev_quarter_end = date(current_date.year, 3, 31)
-        elif quarter_num == 3:
-            prev_quarter_start = date(current_date.year, 4, 1)
-            prev_quarter_end = date(current_date.year, 6, 30)
-        else:  # quarter_num == 4
-            prev_quarter_start = date(current_date.year, 7, 1)
-            prev_quarter_end = date(current_date.year, 9, 30)
+    quarter_num = (current_date.month - 1) // 3 + 1
+    year = current_date.year - (quarter_num == 1)
+    prev_quarter_num = (quarter_num - 2) % 4 + 1
+    start_month = 3 * prev_quarter_num - 2
     
-    return prev_quarter_start, prev_quarter_end
+    return date(year, start_month, 1), date(year, start_month + 2, _QUARTER_END_DAY[prev_quarter_num - 1])
+
+# Columns included in every report, and the query the report filters are appended to
+REPORT_COLUMNS = "id, ucr, company, region, development, plot, stage_5_achieved_date, uprn, postcode"
+REPORT_QUERY = f"SELECT {REPORT_COLUMNS} FROM public.stage_5_plots"
 
 def fetch_data_from_db(conn, query: str, params: tuple = None) -> List[Dict[str, Any]]:
     """Fetch data from database using the given query."""
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        with conn.cursor() as cursor:
             cursor.execute(query, params)
-            results = cursor.fetchall()
-            return [dict(row) for row in results]
+            # Zip plain tuples with the column names once instead of building dict rows in Python
+            colnames = [column.name for column in cursor.description]
+            return [dict(zip(colnames, row)) for row in cursor]
     except Exception as e:
         logging.error(f"Database query failed: {str(e)}")
         raise
 
-def create_csv_report(data: List[Dict[str, Any]], filename: str) -> bytes:
-    """Create a CSV report from the data."""
+def export_csv_to_file(conn, query: str, params: tuple, out: BinaryIO) -> int:
+    """
+    Export the results of the given query as CSV into a binary file-like using
+    COPY ... TO STDOUT, so rows are serialized by Postgres. Returns the number of rows copied.
+    """
+    try:
+        with conn.cursor() as cursor:
+            sql = cursor.mogrify(query, params).decode('utf-8')
+            cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH CSV HEADER", out)
+            return cursor.rowcount
+    except Exception as e:
+        logging.error(f"Database CSV export failed: {str(e)}")
+        raise
+
+def copy_query_to_csv(conn, query: str, params: tuple = None) -> Tuple[bytes, int]:
+    """Export the results of the given query as CSV. Returns the CSV data and the number of rows copied."""
+    csv_buffer = io.BytesIO()
+    record_count = export_csv_to_file(conn, query, params, csv_buffer)
+    return csv_buffer.getvalue(), record_count
+
+def create_csv_report(
+    data: Iterable[Dict[str, Any]],
+    filename: str,
+    output: BinaryIO = None
+) -> Union[bytes, BinaryIO]:
+    """
+    Create a CSV report from the data.
+    Returns the CSV bytes, or, when a binary file-like output is given, writes the CSV
+    into it and returns it rewound so large reports need not be held as one bytes object.
+    """
     try:
-        # Convert to DataFrame and exclude helper columns
-        df = pd.DataFrame(data)
-        columns_to_exclude = ['report_month', 'report_quarter', 'created_at', 'updated_at']
-        
-        # Only exclude columns if they exist in the DataFrame
-        existing_columns = [col for col in columns_to_exclude if col in df.columns]
-        if existing_columns:
-            df = df.drop(columns=existing_columns)
-        
-        # Convert to CSV
-        csv_buffer = io.StringIO()
-        df.to_csv(csv_buffer, index=False)
-        return csv_buffer.getvalue().encode('utf-8')
+        rows = iter(data)
+        first_row = next(rows, None)
+        if first_row is None:
+            return b'' if output is None else output
+        
+        # Exclude helper columns
+        columns_to_exclude = {'report_month', 'report_quarter', 'created_at', 'updated_at'}
+        fieldnames = [col for col in first_row.keys() if col not in columns_to_exclude]
+        
+        # Pipe the row values straight into csv.writer; itemgetter, map, zip and writerows
+        # all run in C, so no per-row Python code runs while writing. A single-key itemgetter
+        # returns the bare value, so zip wraps it back into a one-column row.
+        all_rows = itertools.chain((first_row,), rows)
+        if len(fieldnames) > 1:
+            row_values = map(operator.itemgetter(*fieldnames), all_rows)
+        else:
+            row_values = zip(map(operator.itemgetter(fieldnames[0]), all_rows))
+        
+        # Encode into the byte buffer as rows are written rather than building one large
+        # str and encoding a second copy of it at the end
+        target = io.BytesIO() if output is None else output
+        csv_buffer = io.TextIOWrapper(target, encoding='utf-8', newline='')
+        writer = csv.writer(csv_buffer, lineterminator='\n')
+        writer.writerow(fieldnames)
+        writer.writerows(row_values)
+        csv_buffer.flush()
+        csv_buffer.detach()
+        if output is None:
+            return target.getvalue()
+        
+        output.seek(0)
+        return output
     except Exception as e:
         logging.error(f"CSV creation failed: {str(e)}")
         raise
 
+def find_non_empty_queries(queries: Dict[str, tuple]) -> List[str]:
+    """Return the names of the (query, params) pairs that match any rows, probed with EXISTS in one round-trip."""
+    names = list(queries)
+    probe_query = "SELECT " + ", ".join(f"EXISTS({queries[name][0]})" for name in names)
+    probe_params = tuple(param for name in names for param in queries[name][1])
+    
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(probe_query, probe_params)
+            has_rows = cursor.fetchone()
+    except Exception as e:
+        logging.error(f"Database query failed: {str(e)}")
+        raise
+    finally:
+        release_db_connection(conn)
+    
+    return [name for name, exists in zip(names, has_rows) if exists]
+
+def warn_on_sequential_scans(queries: Dict[str, tuple]) -> None:
+    """Log a warning for each (query, params) pair whose plan scans a table sequentially."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cursor:
+            for name, (query, params) in queries.items():
+                cursor.execute(f"EXPLAIN {query}", params)
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+                if "Seq Scan" in plan:
+                    logging.warning(f"The {name} report query uses a sequential scan; check that migrations/001_stage_5_plots_report_indexes.sql has been applied")
+    except Exception as e:
+        logging.warning(f"Query plan check failed: {str(e)}")
+    finally:
+        if conn is not None:
+            release_db_connection(conn)
+
+def build_email_attachment(data: Union[bytes, BinaryIO], filename: str) -> Dict[str, str]:
+    """
+    Build a SendGrid attachment entry, gzipping the CSV data to shrink the request.
+    The data may be bytes or a binary file-like, which is streamed through gzip from the start.
+    """
+    if isinstance(data, (bytes, bytearray)):
+        compressed = gzip.compress(data, compresslevel=1)
+    else:
+        compressed_buffer = io.BytesIO()
+        data.seek(0)
+        with gzip.GzipFile(fileobj=compressed_buffer, mode='wb', compresslevel=1) as gzip_file:
+            shutil.copyfileobj(data, gzip_file)
+        compressed = compressed_buffer.getvalue()
+    
+    return {
+        "content": base64.b64encode(compressed).decode('ascii'),
+        "type": "application/gzip",
+        "filename": f"{filename}.gz",
+        "disposition": "attachment"
+    }
+
+def build_archive_attachment(archive_data: bytes, filename: str) -> Dict[str, str]:
+    """Build a SendGrid attachment entry for an already-compressed zip archive."""
+    return {
+        "content": base64.b64encode(archive_data).decode('ascii'),
+        "type": "application/zip",
+        "filename": filename,
+        "disposition": "attachment"
+    }
+
+def upload_report_archive(archive_data: bytes, filename: str) -> str:
+    """Upload a zip archive of reports to Blob Storage and return a read-only download URL valid for 7 days."""
+    from azure.storage.blob import BlobSasPermissions, ContentSettings, generate_blob_sas
+    
+    blob_service = get_blob_service_client()
+    blob_client = blob_service.get_blob_client(get_settings()['reports_container'], filename)
+    blob_client.upload_blob(
+        archive_data,
+        overwrite=True,
+        content_settings=ContentSettings(content_type='application/zip')
+    )
+    
+    sas_token = generate_blob_sas(
+        account_name=blob_client.account_name,
+        container_name=blob_client.container_name,
+        blob_name=blob_client.blob_name,
+        account_key=blob_service.credential.account_key,
+        permission=BlobSasPermissions(read=True),
+        expiry=datetime.now(timezone.utc) + timedelta(days=7)
+    )
+    return f"{blob_client.url}?{sas_token}"
+
+def export_reports_concurrently(reports: Dict[str, tuple], archive: zipfile.ZipFile) -> Dict[str, int]:
+    """
+    Export independent (query, params, filename) reports in parallel, each on its own
+    pooled connection. Each CSV is written into the archive as soon as its query finishes,
+    so compression overlaps the queries still running. Returns the record count per report name.
+    """
+    archive_lock = threading.Lock()
+    
+    def build_report(query: str, params: tuple, filename: str) -> int:
+        conn = get_db_connection()
+        try:
+            csv_data, record_count = copy_query_to_csv(conn, query, params)
+        finally:
+            release_db_connection(conn)
+        if record_count:
+            with archive_lock:
+                archive.writestr(filename, csv_data)
+        return record_count
+    
+    with ThreadPoolExecutor(max_workers=len(reports)) as executor:
+        futures = {
+            executor.submit(build_report, query, params, filename): name
+            for name, (query, params, filename) in reports.items()
+        }
+        return {futures[future]: future.result() for future in as_completed(futures)}
+
 def send_email_with_attachment(
     subject: str,
     body: str,
@@ -123,12 +429,10 @@ def send_email_with_attachment(
     """Send email with attachment using SendGrid HTTP API."""
     try:
         # Get configuration
-        bearer_token = os.getenv('SENDGRID_BEARER_TOKEN')
-        sendgrid_endpoint = os.getenv('SENDGRID_ENDPOINT')
-        sender_email = os.getenv('SENDER_EMAIL')
-        
-        if not all([bearer_token, sendgrid_endpoint, sender_email]):
-            raise ValueError("Missing SendGrid configuration: SENDGRID_BEARER_TOKEN, SENDGRID_ENDPOINT, or SENDER_EMAIL")
+        settings = get_settings('email')
+        bearer_token = settings['sendgrid_bearer_token']
+        sendgrid_endpoint = settings['sendgrid_endpoint']
+        sender_email = settings['sender_email']
         
         # Prepare email payload
         email_payload = {
@@ -146,12 +450,7 @@ def send_email_with_attachment(
                 }
             ],
             "attachments": [
-                {
-                    "content": base64.b64encode(attachment_data).decode('utf-8'),
-                    "type": "text/csv",
-                    "filename": attachment_filename,
-                    "disposition": "attachment"
-                }
+                build_email_attachment(attachment_data, attachment_filename)
             ]
         }
         
@@ -161,9 +460,9 @@ def send_email_with_attachment(
             "Content-Type": "application/json"
         }
         
-        response = requests.post(
+        response = get_http_session().post(
             sendgrid_endpoint,
-            json=email_payload,
+            data=orjson.dumps(email_payload),
             headers=headers,
             timeout=30
         )
@@ -185,25 +484,35 @@ def send_email_with_multiple_attachments(
     attachments: List[Dict[str, Any]],
     recipient_emails: List[str]
 ) -> bool:
-    """Send email with multiple attachments using SendGrid HTTP API."""
+    """
+    Send email with multiple attachments using SendGrid HTTP API.
+    Each attachment's 'data' (bytes or a binary file-like) is removed once encoded so the raw CSV can be freed
+    before the request body is serialized.
+    """
     try:
-        # Get configuration
-        bearer_token = os.getenv('SENDGRID_BEARER_TOKEN')
-        sendgrid_endpoint = os.getenv('SENDGRID_ENDPOINT')
-        sender_email = os.getenv('SENDER_EMAIL')
-        
-        if not all([bearer_token, sendgrid_endpoint, sender_email]):
-            raise ValueError("Missing SendGrid configuration: SENDGRID_BEARER_TOKEN, SENDGRID_ENDPOINT, or SENDER_EMAIL")
-        
         # Prepare attachments
         email_attachments = []
         for attachment in attachments:
-            email_attachments.append({
-                "content": base64.b64encode(attachment['data']).decode('utf-8'),
-                "type": "text/csv",
-                "filename": attachment['filename'],
-                "disposition": "attachment"
-            })
+            email_attachments.append(build_email_attachment(attachment.pop('data'), attachment['filename']))
+    except Exception as e:
+        logging.error(f"Email sending failed: {str(e)}")
+        return False
+    
+    return send_email_with_encoded_attachments(subject, body, email_attachments, recipient_emails)
+
+def send_email_with_encoded_attachments(
+    subject: str,
+    body: str,
+    email_attachments: List[Dict[str, str]],
+    recipient_emails: List[str]
+) -> bool:
+    """Send email with attachments already built by build_email_attachment using SendGrid HTTP API."""
+    try:
+        # Get configuration
+        settings = get_settings('email')
+        bearer_token = settings['sendgrid_bearer_token']
+        sendgrid_endpoint = settings['sendgrid_endpoint']
+        sender_email = settings['sender_email']
         
         # Prepare email payload
         email_payload = {
@@ -219,9 +528,11 @@ def send_email_with_multiple_attachments(
                     "type": "text/html",
                     "value": body
                 }
-            ],
-            "attachments": email_attachments
+            ]
         }
+        # SendGrid rejects an empty attachments list
+        if email_attachments:
+            email_payload["attachments"] = email_attachments
         
         # Send email via HTTP API
         headers = {
@@ -229,15 +540,15 @@ def send_email_with_multiple_attachments(
             "Content-Type": "application/json"
         }
         
-        response = requests.post(
+        response = get_http_session().post(
             sendgrid_endpoint,
-            json=email_payload,
+            data=orjson.dumps(email_payload),
             headers=headers,
             timeout=30
         )
         
         if response.status_code in [200, 202]:
-            logging.info(f"Email with {len(attachments)} attachments sent successfully. Status code: {response.status_code}")
+            logging.info(f"Email with {len(email_attachments)} attachments sent successfully. Status code: {response.status_code}")
             return True
         else:
             logging.error(f"Email sending failed. Status code: {response.status_code}, Response: {response.text}")
@@ -247,6 +558,18 @@ def send_email_with_multiple_attachments(
         logging.error(f"Email sending failed: {str(e)}")
         return False
 
+def send_emails_concurrently(emails: List[Dict[str, Any]], max_workers: int = 8) -> List[bool]:
+    """
+    Send several emails in parallel, each given as the keyword arguments of
+    send_email_with_multiple_attachments. Sends are I/O bound, so threads share the
+    HTTP session's connection pool (sized for 8). Returns the success of each email in order.
+    """
+    if not emails:
+        return []
+    
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(emails))) as executor:
+        return list(executor.map(lambda email: send_email_with_multiple_attachments(**email), emails))
+
 def generate_reports_on_demand(current_date: date = None) -> dict:
     """
     Generate reports for a specific date or current date.
@@ -257,102 +580,112 @@ def generate_reports_on_demand(current_date: date = None) -> dict:
     
     logging.info(f'Report generation started for date: {current_date}.')
     
+    # Format the dates used across filenames, email and result once
+    today_long = current_date.strftime('%B %d, %Y')
+    today_iso = current_date.isoformat()
+    
     try:
+        settings = get_settings('database', 'email', 'recipients', 'reports')
         previous_month = get_previous_month_date(current_date)
         is_quarter_end_date = is_quarter_end(current_date)
+        previous_month_tag = previous_month.strftime('%Y_%m')
         
-        # Get database connection
-        conn = get_db_connection()
+        # Export monthly (previous month), cumulative (from 01/08) and, at quarter end,
+        # quarterly reports concurrently so database time is the slowest query, not the sum
+        cumulative_start_date = settings['cumulative_start_date']
+        report_queries = {
+            'monthly': (f"{REPORT_QUERY} WHERE report_month = %s", (previous_month,), f"monthly_report_{previous_month_tag}.csv"),
+            'cumulative': (f"{REPORT_QUERY} WHERE stage_5_achieved_date >= %s", (cumulative_start_date,), f"cumulative_report_{current_date.strftime('%Y_%m')}.csv")
+        }
         
-        # Fetch monthly data (previous month)
-        monthly_query = """
-            SELECT id, ucr, company, region, development, plot, 
-                   stage_5_achieved_date, uprn, postcode
-            FROM public.stage_5_plots
-            WHERE report_month = %s
-        """
-        monthly_data = fetch_data_from_db(conn, monthly_query, (previous_month,))
-        
-        # Fetch cumulative data (from 01/08)
-        cumulative_start_date = datetime.strptime(os.getenv('CUMULATIVE_START_DATE'), '%Y-%m-%d').date()
-        cumulative_query = """
-            SELECT id, ucr, company, region, development, plot, 
-                   stage_5_achieved_date, uprn, postcode
-            FROM public.stage_5_plots
-            WHERE stage_5_achieved_date >= %s
-        """
-        cumulative_data = fetch_data_from_db(conn, cumulative_query, (cumulative_start_date,))
+        if is_quarter_end_date:
+            previous_quarter_start, previous_quarter_end = get_previous_quarter_dates(current_date)
+            previous_quarter_label = f"Q{get_quarter_dates(previous_quarter_start)[2]} {previous_quarter_start.year}"
+            report_queries['quarterly'] = (f"{REPORT_QUERY} WHERE report_quarter >= %s AND report_quarter <= %s", (previous_quarter_start, previous_quarter_end), f"quarterly_report_{previous_quarter_start.year}_Q{get_quarter_dates(previous_quarter_start)[2]}.csv")
+        
+        # Connect to Blob Storage before any queries so a bad storage configuration fails the
+        # run before the database work rather than after it
+        if settings['reports_storage_connection_string']:
+            get_blob_service_client()
+        
+        # Check each selective report query uses its index once per worker; the quarterly
+        # query is checked on the first quarter-end run. The cumulative query reads most of
+        # the table, so a sequential scan is expected there.
+        unchecked_queries = {
+            name: (query, params)
+            for name, (query, params, _) in report_queries.items()
+            if name != 'cumulative' and name not in _QUERY_PLANS_CHECKED
+        }
+        if unchecked_queries:
+            _QUERY_PLANS_CHECKED.update(unchecked_queries)
+            warn_on_sequential_scans(unchecked_queries)
+        
+        # Only export the reports that have data; empty runs make no export queries
+        non_empty_reports = find_non_empty_queries({
+            name: (query, params) for name, (query, params, _) in report_queries.items()
+        })
+        
+        # Bundle all reports into one zip so the email carries a single compressed file
+        archive_filename = f"stage_5_reports_{today_iso.replace('-', '_')}.zip"
+        archive_buffer = io.BytesIO()
+        record_counts = {}
+        if non_empty_reports:
+            with zipfile.ZipFile(archive_buffer, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+                record_counts = export_reports_concurrently(
+                    {name: report_queries[name] for name in non_empty_reports},
+                    archive
+                )
+        monthly_count = record_counts.get('monthly', 0)
+        cumulative_count = record_counts.get('cumulative', 0)
+        quarterly_count = record_counts.get('quarterly', 0)
         
         # Prepare email content
-        recipient_emails = os.getenv('RECIPIENT_EMAILS').split(',')
+        recipient_emails = settings['recipient_emails']
         
         # Prepare all reports for single email
-        all_reports = []
+        reports_generated = 0
         email_body = f"""
-        <h2>Stage 5 Completion Reports - {current_date.strftime('%B %d, %Y')}</h2>
-        <p>Please find attached the following reports generated on {current_date.strftime('%Y-%m-%d')}:</p>
+        <h2>Stage 5 Completion Reports - {today_long}</h2>
+        <p>The following reports were generated on {today_iso}:</p>
         <ul>
         """
         
         # Monthly report
-        if monthly_data:
-            monthly_csv = create_csv_report(monthly_data, f"monthly_report_{previous_month.strftime('%Y_%m')}.csv")
-            monthly_filename = f"monthly_report_{previous_month.strftime('%Y_%m')}.csv"
-            
-            all_reports.append({
-                'data': monthly_csv,
-                'filename': monthly_filename
-            })
-            
-            email_body += f"<li><strong>Monthly Report - {previous_month.strftime('%B %Y')}</strong>: {len(monthly_data)} records</li>"
+        if monthly_count:
+            reports_generated += 1
+            email_body += f"<li><strong>Monthly Report - {previous_month.strftime('%B %Y')}</strong>: {monthly_count} records</li>"
         
         # Cumulative report
-        if cumulative_data:
-            cumulative_csv = create_csv_report(cumulative_data, f"cumulative_report_{current_date.strftime('%Y_%m')}.csv")
-            cumulative_filename = f"cumulative_report_{current_date.strftime('%Y_%m')}.csv"
-            
-            all_reports.append({
-                'data': cumulative_csv,
-                'filename': cumulative_filename
-            })
-            
-            email_body += f"<li><strong>Cumulative Report</strong> - <strong>Since 1st of August 2025</strong>: {len(cumulative_data)} records</li>"
+        if cumulative_count:
+            reports_generated += 1
+            email_body += f"<li><strong>Cumulative Report</strong> - <strong>Since 1st of August 2025</strong>: {cumulative_count} records</li>"
         
-        # Quarterly report (if quarter has ended)
-        if is_quarter_end_date:
-            previous_quarter_start, previous_quarter_end = get_previous_quarter_dates(current_date)
-            
-            quarterly_query = """
-                SELECT id, ucr, company, region, development, plot, 
-                       stage_5_achieved_date, uprn, postcode
-                FROM public.stage_5_plots
-                WHERE report_quarter >= %s AND report_quarter <= %s
-            """
-            quarterly_data = fetch_data_from_db(conn, quarterly_query, (previous_quarter_start, previous_quarter_end))
-            
-            if quarterly_data:
-                quarterly_csv = create_csv_report(quarterly_data, f"quarterly_report_{previous_quarter_start.strftime('%Y')}_Q{get_quarter_dates(previous_quarter_start)[2]}.csv")
-                quarterly_filename = f"quarterly_report_{previous_quarter_start.strftime('%Y')}_Q{get_quarter_dates(previous_quarter_start)[2]}.csv"
-                
-                all_reports.append({
-                    'data': quarterly_csv,
-                    'filename': quarterly_filename
-                })
-                
-                email_body += f"<li><strong>Quarterly Report - Q{get_quarter_dates(previous_quarter_start)[2]} {previous_quarter_start.strftime('%Y')}</strong>: {len(quarterly_data)} records ({previous_quarter_start.strftime('%Y-%m-%d')} to {previous_quarter_end.strftime('%Y-%m-%d')})</li>"
+        # Quarterly report (only fetched if quarter has ended)
+        if quarterly_count:
+            reports_generated += 1
+            email_body += f"<li><strong>Quarterly Report - {previous_quarter_label}</strong>: {quarterly_count} records ({previous_quarter_start.isoformat()} to {previous_quarter_end.isoformat()})</li>"
         
         email_body += """
         </ul>
         """
         
         # Send single email with all reports
-        if all_reports:
-            subject = f"Stage 5 Completion Reports - {current_date.strftime('%B %d, %Y')}"
+        if reports_generated:
+            # Link the archive from Blob Storage when configured, otherwise attach it
+            if settings['reports_storage_connection_string']:
+                archive_url = upload_report_archive(archive_buffer.getvalue(), archive_filename)
+                email_body += f"<p><a href=\"{archive_url}\">Download all reports ({archive_filename})</a> - link valid for 7 days.</p>"
+                email_attachments = []
+            else:
+                email_body += f"<p>All reports are attached in {archive_filename}.</p>"
+                email_attachments = [build_archive_attachment(archive_buffer.getvalue(), archive_filename)]
+            
+            subject = f"Stage 5 Completion Reports - {today_long}"
             
-            success = send_email_with_multiple_attachments(
+            success = send_email_with_encoded_attachments(
                 subject,
                 email_body,
-                all_reports,
+                email_attachments,
                 recipient_emails
             )
             
@@ -360,34 +693,33 @@ def generate_reports_on_demand(current_date: date = None) -> dict:
                 logging.info(f'Reports generated and sent successfully for {current_date}.')
                 result = {
                     'success': True,
-                    'date': current_date.strftime('%Y-%m-%d'),
-                    'reports_generated': len(all_reports),
-                    'monthly_records': len(monthly_data) if monthly_data else 0,
-                    'quarterly_records': len(quarterly_data) if 'quarterly_data' in locals() and quarterly_data else 0,
-                    'cumulative_records': len(cumulative_data) if cumulative_data else 0,
-                    'message': f'Successfully generated {len(all_reports)} reports for {current_date.strftime("%B %d, %Y")}'
+                    'date': today_iso,
+                    'reports_generated': reports_generated,
+                    'monthly_records': monthly_count,
+                    'quarterly_records': quarterly_count,
+                    'cumulative_records': cumulative_count,
+                    'message': f'Successfully generated {reports_generated} reports for {today_long}'
                 }
             else:
                 result = {
                     'success': False,
-                    'date': current_date.strftime('%Y-%m-%d'),
+                    'date': today_iso,
                     'error': 'Failed to send email'
                 }
         else:
             result = {
                 'success': False,
-                'date': current_date.strftime('%Y-%m-%d'),
+                'date': today_iso,
                 'error': 'No reports generated - no data found'
             }
         
-        conn.close()
         return result
         
     except Exception as e:
         logging.error(f'Report generation failed for {current_date}: {str(e)}')
         return {
             'success': False,
-            'date': current_date.strftime('%Y-%m-%d') if current_date else 'Unknown',
+            'date': today_iso,
             'error': str(e)
         }
 
@@ -0,0 +1,21 @@
+-- Indexes backing the report queries in function_app.py.
+-- CREATE INDEX CONCURRENTLY cannot run inside a transaction block, so run this
+-- file with autocommit enabled, e.g.:
+--   psql "$DB_CONNECTION_STRING" -f migrations/001_stage_5_plots_report_indexes.sql
+
+-- Monthly report: WHERE report_month = %s
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_s5_report_month
+    ON public.stage_5_plots (report_month);
+
+-- Cumulative and current-quarter reports: WHERE stage_5_achieved_date >= %s [AND <= %s]
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_s5_achieved_date
+    ON public.stage_5_plots (stage_5_achieved_date);
+
+-- Quarterly report: WHERE report_quarter >= %s AND report_quarter <= %s
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_s5_report_quarter
+    ON public.stage_5_plots (report_quarter);
+
+-- Verify the report queries use the indexes:
+--   EXPLAIN ANALYZE SELECT * FROM public.stage_5_plots WHERE report_month = '2025-07-01';
+--   EXPLAIN ANALYZE SELECT * FROM public.stage_5_plots WHERE report_quarter >= '2025-04-01' AND report_quarter <= '2025-06-30';
+--   EXPLAIN ANALYZE SELECT * FROM public.stage_5_plots WHERE stage_5_achieved_date >= '2025-08-01';
@@ -4,9 +4,13 @@ Test script for the automated reporting function.
 This script allows you to test the function logic locally without deploying to Azure.
 """
 
+import contextlib
+import io
 import os
 import sys
+import tempfile
 from datetime import datetime, date
+import orjson
 from dotenv import load_dotenv
 
 # Add the current directory to Python path
@@ -18,10 +22,30 @@ from function_app import (
     is_quarter_end,
     get_previous_month_date,
     get_previous_quarter_dates,
+    get_db_connection,
+    release_db_connection,
+    fetch_data_from_db,
+    export_csv_to_file,
     create_csv_report,
-    send_email_with_attachment
+    send_email_with_attachment,
+    send_emails_concurrently,
+    REPORT_COLUMNS,
+    REPORT_QUERY
 )
 
+# Email test reports are spooled in memory up to this size, then spill to a temporary file
+REPORT_SPOOL_MAX_SIZE = 16 << 20
+
+# Rows fetched during this test run, keyed by (query, params); the harness only reads
+_QUERY_CACHE = {}
+
+def fetch_data_cached(conn, query, params=None):
+    """Fetch data with fetch_data_from_db, reusing the rows of an identical earlier query."""
+    key = (query, params)
+    if key not in _QUERY_CACHE:
+        _QUERY_CACHE[key] = fetch_data_from_db(conn, query, params)
+    return _QUERY_CACHE[key]
+
 def test_date_calculations():
     """Test the date calculation functions."""
     print("Testing date calculations...")
@@ -55,15 +79,17 @@ def test_csv_generation():
     
     try:
         # Get real data from database
-        from function_app import get_db_connection, fetch_data_from_db
-        
         conn = get_db_connection()
         
-        # Query all data from the table
-        query = "SELECT * FROM public.stage_5_plots"
-        real_data = fetch_data_from_db(conn, query)
+        # Export all report columns from the table as CSV straight from Postgres
+        query = REPORT_QUERY
+        csv_buffer = io.BytesIO()
+        record_count = export_csv_to_file(conn, query, None, csv_buffer)
         
-        if not real_data:
+        if record_count:
+            print(f"📊 Retrieved {record_count} records from database")
+            csv_data = csv_buffer.getvalue()
+        else:
             print("⚠️  No data found in table. Using sample data instead.")
             # Fallback to sample data if table is empty
             real_data = [
@@ -83,21 +109,24 @@ def test_csv_generation():
                     'updated_at': '2025-07-16 17:19:46.142245'
                 }
             ]
+            
+            # Generate CSV from sample data
+            csv_data = create_csv_report(real_data, "test_report.csv")
         
-        print(f"📊 Retrieved {len(real_data)} records from database")
-        
-        # Generate CSV from real data
-        csv_data = create_csv_report(real_data, "test_report.csv")
         print(f"✅ CSV generated successfully. Size: {len(csv_data)} bytes")
         
-        # Show first few lines of CSV
-        csv_content = csv_data.decode('utf-8')
-        lines = csv_content.split('\n')[:5]
+        # Show first few lines of CSV, decoding only those lines
         print("CSV preview:")
-        for line in lines:
-            print(f"  {line}")
-        
-        conn.close()
+        line_start = 0
+        for _ in range(5):
+            line_end = csv_data.find(b'\n', line_start)
+            if line_end < 0:
+                print(f"  {csv_data[line_start:].decode('utf-8', 'replace')}")
+                break
+            print(f"  {csv_data[line_start:line_end].decode('utf-8', 'replace')}")
+            line_start = line_end + 1
+        
+        release_db_connection(conn)
             
     except Exception as e:
         print(f"❌ CSV generation failed: {str(e)}")
@@ -109,25 +138,23 @@ def test_email_function():
     print("Testing email functionality with real data...")
     
     # Check if SendGrid credentials are configured
-    bearer_token = os.getenv('SENDGRID_BEARER_TOKEN')
-    sendgrid_endpoint = os.getenv('SENDGRID_ENDPOINT')
-    sender_email = os.getenv('SENDER_EMAIL')
-    recipient_emails = os.getenv('RECIPIENT_EMAILS')
+    sendgrid_settings = {
+        key: os.environ.get(key)
+        for key in ('SENDGRID_BEARER_TOKEN', 'SENDGRID_ENDPOINT', 'SENDER_EMAIL', 'RECIPIENT_EMAILS')
+    }
     
-    if not all([bearer_token, sendgrid_endpoint, sender_email, recipient_emails]):
+    if not all(sendgrid_settings.values()):
         print("SendGrid credentials not configured. Skipping email test.")
         print("Please set SENDGRID_BEARER_TOKEN, SENDGRID_ENDPOINT, SENDER_EMAIL, and RECIPIENT_EMAILS in local.settings.json")
         return
     
+    # Closes the reports' spooled files, including any that spilled to disk, once the test is done
+    report_files = contextlib.ExitStack()
     try:
         # Get real data from database
-        from function_app import get_db_connection, fetch_data_from_db, create_csv_report
-        
         conn = get_db_connection()
         
         # Test multiple scenarios to show different report types
-        from datetime import date
-        
         print("📅 Testing multiple scenarios with real data...")
         
         # Scenario 1: August 1st (current month - should show July data)
@@ -140,52 +167,93 @@ def test_email_function():
         print(f"   Previous month: {july_month}")
         print(f"   Cumulative start: {cumulative_start}")
         
-        # Generate reports for August 1st scenario
-        reports_aug = []
+        # Scenario 2: April 1st (quarterly report day)
+        apr_1st = date(2025, 4, 1)
+        mar_month = date(2025, 3, 1)
+        q1_start = date(2025, 1, 1)
+        q1_end = date(2025, 3, 31)
         
-        # Monthly Report (July data)
-        monthly_query_july = """
-            SELECT id, ucr, company, region, development, plot, 
-                   stage_5_achieved_date, uprn, postcode
+        # Q3 Current Quarter (from July 1st to current date)
+        test_date = date.today()
+        quarter_start_current, quarter_end_current, quarter_num_current = get_quarter_dates(test_date)
+        
+        # Fetch every scenario's data in one round-trip, tagging each row with its report
+        combined_query = f"""
+            SELECT 'monthly_july' AS report_kind, {REPORT_COLUMNS}
+            FROM public.stage_5_plots
+            WHERE report_month = %s
+            UNION ALL
+            SELECT 'monthly_mar' AS report_kind, {REPORT_COLUMNS}
             FROM public.stage_5_plots
             WHERE report_month = %s
+            UNION ALL
+            SELECT 'cumulative' AS report_kind, {REPORT_COLUMNS}
+            FROM public.stage_5_plots
+            WHERE stage_5_achieved_date >= %s
+            UNION ALL
+            SELECT 'quarterly' AS report_kind, {REPORT_COLUMNS}
+            FROM public.stage_5_plots
+            WHERE report_quarter >= %s AND report_quarter <= %s
+            UNION ALL
+            SELECT 'q3_current' AS report_kind, {REPORT_COLUMNS}
+            FROM public.stage_5_plots
+            WHERE stage_5_achieved_date >= %s AND stage_5_achieved_date <= %s
         """
-        monthly_data_july = fetch_data_from_db(conn, monthly_query_july, (july_month,))
+        combined_params = (july_month, mar_month, cumulative_start, q1_start, q1_end,
+                           quarter_start_current, test_date)
+        data_by_kind = {}
+        for row in fetch_data_from_db(conn, combined_query, combined_params):
+            data_by_kind.setdefault(row.pop('report_kind'), []).append(row)
+        
+        # Build the CSV for every report with data, each into its own spooled buffer. This is
+        # sequential on purpose: the data is already fetched in one query, and CSV encoding
+        # holds the GIL, so a thread pool gives no measurable speed-up
+        report_filenames = {
+            'monthly_july': f"monthly_report_{july_month.strftime('%Y_%m')}.csv",
+            'cumulative': f"cumulative_report_{aug_1st.strftime('%Y_%m')}.csv",
+            'monthly_mar': f"monthly_report_{mar_month.strftime('%Y_%m')}.csv",
+            'quarterly': f"quarterly_report_{q1_start.year}_Q1.csv",
+            'q3_current': f"q3_current_quarter_{quarter_start_current.strftime('%Y_%m')}_to_{test_date.strftime('%Y_%m_%d')}.csv"
+        }
+        csv_by_kind = {
+            kind: create_csv_report(
+                data_by_kind[kind],
+                filename,
+                output=report_files.enter_context(tempfile.SpooledTemporaryFile(max_size=REPORT_SPOOL_MAX_SIZE))
+            )
+            for kind, filename in report_filenames.items()
+            if kind in data_by_kind
+        }
+        
+        # Generate reports for August 1st scenario
+        reports_aug = []
+        
+        # Monthly Report (July data)
+        monthly_data_july = data_by_kind.get('monthly_july', [])
         if monthly_data_july:
-            monthly_csv_july = create_csv_report(monthly_data_july, f"monthly_report_{july_month.strftime('%Y_%m')}.csv")
+            monthly_csv_july = csv_by_kind['monthly_july']
             reports_aug.append({
                 'name': f"Monthly Report - {july_month.strftime('%B %Y')}",
                 'data': monthly_csv_july,
-                'filename': f"monthly_report_{july_month.strftime('%Y_%m')}.csv",
+                'filename': report_filenames['monthly_july'],
                 'count': len(monthly_data_july)
             })
             print(f"   📊 Monthly report (July): {len(monthly_data_july)} records")
         
         # Cumulative Report (from 01/08)
-        cumulative_query_aug = """
-            SELECT id, ucr, company, region, development, plot, 
-                   stage_5_achieved_date, uprn, postcode
-            FROM public.stage_5_plots
-            WHERE stage_5_achieved_date >= %s
-        """
-        cumulative_data_aug = fetch_data_from_db(conn, cumulative_query_aug, (cumulative_start,))
+        cumulative_data_aug = data_by_kind.get('cumulative', [])
         if cumulative_data_aug:
-            cumulative_csv_aug = create_csv_report(cumulative_data_aug, f"cumulative_report_{aug_1st.strftime('%Y_%m')}.csv")
+            cumulative_csv_aug = csv_by_kind['cumulative']
             reports_aug.append({
                 'name': f"Cumulative Report - {aug_1st.strftime('%B %Y')}",
                 'data': cumulative_csv_aug,
-                'filename': f"cumulative_report_{aug_1st.strftime('%Y_%m')}.csv",
+                'filename': report_filenames['cumulative'],
                 'count': len(cumulative_data_aug)
             })
             print(f"   📊 Cumulative report: {len(cumulative_data_aug)} records")
         
         # Scenario 2: April 1st (quarterly report day)
         print("\n🔍 Scenario 2: April 1st (quarterly report day)")
-        apr_1st = date(2025, 4, 1)
-        mar_month = date(2025, 3, 1)
-        q1_start = date(2025, 1, 1)
-        q1_end = date(2025, 3, 31)
-        
         print(f"   Current date: {apr_1st}")
         print(f"   Previous month: {mar_month}")
         print(f"   Previous quarter: {q1_start} to {q1_end}")
@@ -194,59 +262,41 @@ def test_email_function():
         reports_apr = []
         
         # Monthly Report (March data)
-        monthly_data_mar = fetch_data_from_db(conn, monthly_query_july, (mar_month,))
+        monthly_data_mar = data_by_kind.get('monthly_mar', [])
         if monthly_data_mar:
-            monthly_csv_mar = create_csv_report(monthly_data_mar, f"monthly_report_{mar_month.strftime('%Y_%m')}.csv")
+            monthly_csv_mar = csv_by_kind['monthly_mar']
             reports_apr.append({
                 'name': f"Monthly Report - {mar_month.strftime('%B %Y')}",
                 'data': monthly_csv_mar,
-                'filename': f"monthly_report_{mar_month.strftime('%Y_%m')}.csv",
+                'filename': report_filenames['monthly_mar'],
                 'count': len(monthly_data_mar)
             })
             print(f"   📊 Monthly report (March): {len(monthly_data_mar)} records")
         
         # Quarterly Report (Q1 data)
-        quarterly_query = """
-            SELECT id, ucr, company, region, development, plot, 
-                   stage_5_achieved_date, uprn, postcode
-            FROM public.stage_5_plots
-            WHERE report_quarter >= %s AND report_quarter <= %s
-        """
-        quarterly_data = fetch_data_from_db(conn, quarterly_query, (q1_start, q1_end))
+        quarterly_data = data_by_kind.get('quarterly', [])
         if quarterly_data:
-            quarterly_csv = create_csv_report(quarterly_data, f"quarterly_report_{q1_start.strftime('%Y')}_Q1.csv")
+            quarterly_csv = csv_by_kind['quarterly']
             reports_apr.append({
-                'name': f"Quarterly Report - Q1 {q1_start.strftime('%Y')}",
+                'name': f"Quarterly Report - Q1 {q1_start.year}",
                 'data': quarterly_csv,
-                'filename': f"quarterly_report_{q1_start.strftime('%Y')}_Q1.csv",
+                'filename': report_filenames['quarterly'],
                 'count': len(quarterly_data)
             })
             print(f"   📊 Quarterly report (Q1): {len(quarterly_data)} records")
         
-        # Cumulative Report (from 01/08) - same for both scenarios
+        # Cumulative Report (from 01/08) - same for both scenarios, so reuse the August CSV
         if cumulative_data_aug:
-            cumulative_csv_apr = create_csv_report(cumulative_data_aug, f"cumulative_report_{apr_1st.strftime('%Y_%m')}.csv")
             reports_apr.append({
                 'name': f"Cumulative Report - {apr_1st.strftime('%B %Y')}",
-                'data': cumulative_csv_apr,
+                'data': cumulative_csv_aug,
                 'filename': f"cumulative_report_{apr_1st.strftime('%Y_%m')}.csv",
                 'count': len(cumulative_data_aug)
             })
             print(f"   📊 Cumulative report: {len(cumulative_data_aug)} records")
         
         # Create comprehensive reports including Q3 Current Quarter data
-        from datetime import date
-        test_date = date.today()
-        
-        # Get Q3 Current Quarter data (from July 1st to current date)
-        quarter_start_current, quarter_end_current, quarter_num_current = get_quarter_dates(test_date)
-        q3_current_query = """
-            SELECT id, ucr, company, region, development, plot, 
-                   stage_5_achieved_date, uprn, postcode
-            FROM public.stage_5_plots
-            WHERE stage_5_achieved_date >= %s AND stage_5_achieved_date <= %s
-        """
-        q3_current_data = fetch_data_from_db(conn, q3_current_query, (quarter_start_current, test_date))
+        q3_current_data = data_by_kind.get('q3_current', [])
         
         # Create comprehensive reports list
         comprehensive_reports = []
@@ -257,16 +307,16 @@ def test_email_function():
         
         # Add Q3 Current Quarter Report
         if q3_current_data:
-            q3_current_csv = create_csv_report(q3_current_data, f"q3_current_quarter_{quarter_start_current.strftime('%Y_%m')}_to_{test_date.strftime('%Y_%m_%d')}.csv")
+            q3_current_csv = csv_by_kind['q3_current']
             comprehensive_reports.append({
                 'name': f"Q3 Current Quarter Report - {quarter_start_current.strftime('%B %Y')} to {test_date.strftime('%B %d')}",
                 'data': q3_current_csv,
-                'filename': f"q3_current_quarter_{quarter_start_current.strftime('%Y_%m')}_to_{test_date.strftime('%Y_%m_%d')}.csv",
+                'filename': report_filenames['q3_current'],
                 'count': len(q3_current_data)
             })
             print(f"   📊 Q3 Current Quarter report: {len(q3_current_data)} records")
         
-        conn.close()
+        release_db_connection(conn)
         
         if not comprehensive_reports:
             print("   ⚠️  No reports generated - no data found for test dates")
@@ -276,23 +326,25 @@ def test_email_function():
         print(f"\n📧 Sending email with {len(comprehensive_reports)} comprehensive reports...")
         
         # Create email body
-        email_body = f"""
-        <h2>Stage 5 Completion Reports - {test_date.strftime('%B %d, %Y')}</h2>
+        test_date_long = test_date.strftime('%B %d, %Y')
+        email_body_parts = [f"""
+        <h2>Stage 5 Completion Reports - {test_date_long}</h2>
         <p>This is a test email with real data from your database.</p>
         <h3>Reports Generated:</h3>
         <ul>
-        """
+        """]
         
         for report in comprehensive_reports:
             if "Cumulative Report" in report['name']:
-                email_body += f"<li><strong>Cumulative Report</strong> - <strong>Since 1st of August 2025</strong>: {report['count']} records</li>"
+                email_body_parts.append(f"<li><strong>Cumulative Report</strong> - <strong>Since 1st of August 2025</strong>: {report['count']} records</li>")
             else:
-                email_body += f"<li><strong>{report['name']}</strong>: {report['count']} records</li>"
+                email_body_parts.append(f"<li><strong>{report['name']}</strong>: {report['count']} records</li>")
         
-        email_body += """
+        email_body_parts.append(f"""
         </ul>
-        <p>Report generated on: """ + test_date.strftime('%Y-%m-%d') + """</p>
-        """
+        <p>Report generated on: {test_date.isoformat()}</p>
+        """)
+        email_body = ''.join(email_body_parts)
         
         # Print the email body for verification
         print(f"\n📧 Email Body Preview:")
@@ -301,9 +353,6 @@ def test_email_function():
         print("=" * 50)
         
         # Send email with ALL reports as attachments
-        from function_app import send_email_with_multiple_attachments
-        
-        # Prepare attachments for the new function
         attachments = []
         for report in comprehensive_reports:
             attachments.append({
@@ -311,17 +360,19 @@ def test_email_function():
                 'filename': report['filename']
             })
         
-        success = send_email_with_multiple_attachments(
-            subject=f"Stage 5 Completion Reports - {test_date.strftime('%B %d, %Y')}",
-            body=email_body,
-            attachments=attachments,
-            recipient_emails=recipient_emails.split(',')
-        )
+        # Further test emails can be appended here and are sent in parallel
+        emails = [{
+            'subject': f"Stage 5 Completion Reports - {test_date_long}",
+            'body': email_body,
+            'attachments': attachments,
+            'recipient_emails': sendgrid_settings['RECIPIENT_EMAILS'].split(',')
+        }]
+        success = all(send_emails_concurrently(emails))
         
         if success:
             print(f"✅ Test email sent successfully with {len(comprehensive_reports)} attachments!")
             for i, report in enumerate(comprehensive_reports):
-                print(f"   📎 Attachment {i+1}: {report['filename']} ({len(report['data'])} bytes)")
+                print(f"   📎 Attachment {i+1}: {report['filename']} ({report['data'].seek(0, io.SEEK_END)} bytes)")
                 print(f"      📊 Contains: {report['count']} real records")
         else:
             print("❌ Test email failed to send.")
@@ -330,6 +381,8 @@ def test_email_function():
         print(f"❌ Email test failed: {str(e)}")
         import traceback
         traceback.print_exc()
+    finally:
+        report_files.close()
     
     print()
 
@@ -344,7 +397,6 @@ def test_database_connection():
         return
     
     try:
-        from function_app import get_db_connection
         conn = get_db_connection()
         print("Database connection successful!")
         
@@ -354,7 +406,7 @@ def test_database_connection():
             version = cursor.fetchone()
             print(f"Database version: {version[0]}")
         
-        conn.close()
+        release_db_connection(conn)
         
     except Exception as e:
         print(f"Database connection failed: {str(e)}")
@@ -366,14 +418,35 @@ def test_all_report_variants():
     print("Testing all report variants with real data...")
     
     try:
-        from function_app import (
-            get_db_connection, fetch_data_from_db, create_csv_report,
-            get_quarter_dates, is_quarter_end, get_previous_month_date,
-            get_previous_quarter_dates
-        )
-        
         conn = get_db_connection()
         
+        # Prepare each report query once; the scenarios below only send EXECUTE with their dates
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                PREPARE monthly_stmt (date) AS
+                {REPORT_QUERY}
+                WHERE report_month = $1
+            """)
+            cursor.execute(f"""
+                PREPARE cumulative_stmt (date) AS
+                {REPORT_QUERY}
+                WHERE stage_5_achieved_date >= $1
+            """)
+            cursor.execute(f"""
+                PREPARE quarterly_stmt (date, date) AS
+                {REPORT_QUERY}
+                WHERE report_quarter >= $1 AND report_quarter <= $2
+            """)
+            cursor.execute(f"""
+                PREPARE q3_current_stmt (date, date) AS
+                {REPORT_QUERY}
+                WHERE stage_5_achieved_date >= $1 AND stage_5_achieved_date <= $2
+            """)
+        monthly_query = "EXECUTE monthly_stmt (%s)"
+        cumulative_query = "EXECUTE cumulative_stmt (%s)"
+        quarterly_query = "EXECUTE quarterly_stmt (%s, %s)"
+        q3_current_query = "EXECUTE q3_current_stmt (%s, %s)"
+        
         # Test 1: Current date (August 11, 2025)
         print("\n📅 Test 1: Current Date (August 11, 2025)")
         current_date = date.today()
@@ -431,34 +504,17 @@ def test_all_report_variants():
         print("\n📊 Test 5: Generating actual reports with real data")
         
         # Monthly report (previous month data)
-        monthly_query = """
-            SELECT id, ucr, company, region, development, plot, 
-                   stage_5_achieved_date, uprn, postcode
-            FROM public.stage_5_plots
-            WHERE report_month = %s
-        """
-        monthly_data = fetch_data_from_db(conn, monthly_query, (prev_month_apr,))
+        monthly_data = fetch_data_cached(conn, monthly_query, (prev_month_apr,))
         print(f"   Monthly data (previous month): {len(monthly_data)} records")
         
         # Cumulative report (from 01/08)
         cumulative_start_date = datetime.strptime(os.getenv('CUMULATIVE_START_DATE'), '%Y-%m-%d').date()
-        cumulative_query = """
-            SELECT id, ucr, company, region, development, plot, 
-                   stage_5_achieved_date, uprn, postcode
-            FROM public.stage_5_plots
-            WHERE stage_5_achieved_date >= %s
-        """
-        cumulative_data = fetch_data_from_db(conn, cumulative_query, (cumulative_start_date,))
+        cumulative_params = (cumulative_start_date,)
+        cumulative_data = fetch_data_cached(conn, cumulative_query, cumulative_params)
         print(f"   Cumulative data (from {cumulative_start_date}): {len(cumulative_data)} records")
         
         # Quarterly report (previous quarter data)
-        quarterly_query = """
-            SELECT id, ucr, company, region, development, plot, 
-                   stage_5_achieved_date, uprn, postcode
-            FROM public.stage_5_plots
-            WHERE report_quarter >= %s AND report_quarter <= %s
-        """
-        quarterly_data = fetch_data_from_db(conn, quarterly_query, (prev_q_start, prev_q_end))
+        quarterly_data = fetch_data_cached(conn, quarterly_query, (prev_q_start, prev_q_end))
         print(f"   Quarterly data (previous quarter): {len(quarterly_data)} records")
         
         # Generate CSV reports
@@ -478,15 +534,15 @@ def test_all_report_variants():
         print("\n📊 Test Q3 End Scenario (September 30th) with real data")
         
         # Monthly report for August (previous month from September 30th)
-        monthly_data_q3 = fetch_data_from_db(conn, monthly_query, (prev_month_sep,))
+        monthly_data_q3 = fetch_data_cached(conn, monthly_query, (prev_month_sep,))
         print(f"   Monthly data (August): {len(monthly_data_q3)} records")
         
         # Quarterly report for Q2 (previous quarter from Q3 end)
-        quarterly_data_q3 = fetch_data_from_db(conn, quarterly_query, (prev_q_start_sep, prev_q_end_sep))
+        quarterly_data_q3 = fetch_data_cached(conn, quarterly_query, (prev_q_start_sep, prev_q_end_sep))
         print(f"   Quarterly data (Q2): {len(quarterly_data_q3)} records")
         
         # Cumulative report (from 01/08)
-        cumulative_data_q3 = fetch_data_from_db(conn, cumulative_query, (cumulative_start_date,))
+        cumulative_data_q3 = fetch_data_cached(conn, cumulative_query, cumulative_params)
         print(f"   Cumulative data (from {cumulative_start_date}): {len(cumulative_data_q3)} records")
         
         # Generate CSV reports for Q3 end scenario
@@ -517,21 +573,15 @@ def test_all_report_variants():
         print(f"   Is quarter end: {is_q_end_current}")
         
         # Monthly report for July (previous month from August 11th)
-        monthly_data_current = fetch_data_from_db(conn, monthly_query, (prev_month_current,))
+        monthly_data_current = fetch_data_cached(conn, monthly_query, (prev_month_current,))
         print(f"   Monthly data (July): {len(monthly_data_current)} records")
         
         # Q3 Current Quarter data (from July 1st to current date)
-        q3_current_query = """
-            SELECT id, ucr, company, region, development, plot, 
-                   stage_5_achieved_date, uprn, postcode
-            FROM public.stage_5_plots
-            WHERE stage_5_achieved_date >= %s AND stage_5_achieved_date <= %s
-        """
-        q3_current_data = fetch_data_from_db(conn, q3_current_query, (quarter_start_current, current_date_q3))
+        q3_current_data = fetch_data_cached(conn, q3_current_query, (quarter_start_current, current_date_q3))
         print(f"   Q3 Current Quarter data (July 1st to {current_date_q3}): {len(q3_current_data)} records")
         
         # Cumulative report (from 01/08)
-        cumulative_data_current = fetch_data_from_db(conn, cumulative_query, (cumulative_start_date,))
+        cumulative_data_current = fetch_data_cached(conn, cumulative_query, cumulative_params)
         print(f"   Cumulative data (from {cumulative_start_date}): {len(cumulative_data_current)} records")
         
         # Generate CSV reports for current Q3 scenario
@@ -547,7 +597,10 @@ def test_all_report_variants():
             cumulative_csv_current = create_csv_report(cumulative_data_current, f"cumulative_report_{current_date_q3.strftime('%Y_%m')}.csv")
             print(f"   ✅ Cumulative CSV generated: {len(cumulative_csv_current)} bytes")
         
-        conn.close()
+        # Prepared statements live for the session, so drop them before returning the connection to the pool
+        with conn.cursor() as cursor:
+            cursor.execute("DEALLOCATE ALL")
+        release_db_connection(conn)
         
     except Exception as e:
         print(f"❌ Report variants test failed: {str(e)}")
@@ -559,13 +612,11 @@ def test_all_report_variants():
 def load_local_settings():
     """Load Azure Functions local settings."""
     try:
-        import json
-        with open('local.settings.json', 'r') as f:
-            settings = json.load(f)
+        with open('local.settings.json', 'rb') as f:
+            settings = orjson.loads(f.read())
         
         # Set environment variables from local.settings.json
-        for key, value in settings.get('Values', {}).items():
-            os.environ[key] = value
+        os.environ.update(settings.get('Values', {}))
             
         print("✅ Local settings loaded successfully")
         return True